@@ -5,17 +5,25 @@ MITRE ATT&CK Matrix FastAPI Backend
 FastAPI приложение для загрузки, кэширования и предоставления MITRE матрицы
 """
 
-import json
 import asyncio
 import aiohttp
+import gzip
+import hashlib
+import ijson
 import logging
+import orjson
+import sys
+from collections import defaultdict
+from dataclasses import dataclass, field
 from datetime import datetime
-from contextlib import asynccontextmanager
-from typing import Dict, List, Optional
-from fastapi import FastAPI, HTTPException, Query
+from itertools import chain, islice
+from contextlib import asynccontextmanager, suppress
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TypedDict
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from pydantic import BaseModel
 from pathlib import Path
 
@@ -26,8 +34,32 @@ logger = logging.getLogger(__name__)
 # Константы
 GITHUB_URL = "https://raw.githubusercontent.com/mitre-attack/attack-stix-data/master/enterprise-attack/enterprise-attack.json"
 CACHE_DIR = Path("./cache")
-CACHE_FILE = CACHE_DIR / "mitre_matrix.json"
+CACHE_FILE = CACHE_DIR / "mitre_matrix.json.gz"
+# Несжатый кэш прежних версий: удаляется после первого успешного сохранения
+LEGACY_CACHE_FILE = CACHE_DIR / "mitre_matrix.json"
 CACHE_METADATA = CACHE_DIR / "metadata.json"
+FRONTEND_INDEX = Path("frontend/index.html")
+
+# Типы STIX-объектов, которые нужны для построения матрицы.
+# Остальные (relationship, intrusion-set, malware...) отбрасываются ещё при загрузке
+# Константы интернируются явно: литералы с дефисом CPython сам не интернирует
+STIX_TACTIC = sys.intern("x-mitre-tactic")
+STIX_ATTACK_PATTERN = sys.intern("attack-pattern")
+STIX_OBJECT_TYPES = {STIX_TACTIC, STIX_ATTACK_PATTERN}
+# Поля STIX-объектов, которые читает parse_matrix. Остальные (created, modified,
+# x_mitre_contributors, object_marking_refs...) не удерживаются в памяти
+STIX_OBJECT_FIELDS = (
+    "type",
+    "id",
+    "name",
+    "description",
+    "x_mitre_shortname",
+    "x_mitre_is_subtechnique",
+    "x_mitre_platforms",
+    "x_mitre_detection",
+    "kill_chain_phases",
+    "external_references",
+)
 
 # Интервалы обновления (в секундах)
 UPDATE_INTERVALS = {
@@ -37,20 +69,54 @@ UPDATE_INTERVALS = {
     "24_hours": 86400,
     "7_days": 604800,
 }
+# Обратное соответствие: секунды -> название интервала
+SECONDS_TO_LABEL = {v: k for k, v in UPDATE_INTERVALS.items()}
 
 
+@dataclass(slots=True)
 class AppState:
     """Глобальное состояние приложения"""
 
     matrix_data: Optional[Dict] = None
+    # Общая HTTP-сессия: переиспользует соединения и DNS-кэш между обновлениями
+    http: Optional[aiohttp.ClientSession] = None
+    # Сериализованная матрица и её ETag, пересчитываются только при обновлении
+    matrix_data_bytes: Optional[bytes] = None
+    matrix_data_etag: Optional[str] = None
+    # Та же матрица, сжатая gzip: отдаётся клиентам с Accept-Encoding: gzip и пишется в кэш
+    matrix_data_gzip: Optional[bytes] = None
+    # Разные кодировки одного ресурса должны иметь разные сильные ETag (RFC 9110)
+    matrix_data_gzip_etag: Optional[str] = None
+    # Готовое тело ответа /api/matrix/tactics
+    tactics_bytes: Optional[bytes] = None
+    # Тела ответов /api/matrix/tactic/{tactic}: заполняются при первом запросе,
+    # сбрасываются при каждом обновлении матрицы
+    tactic_bytes: Dict[str, bytes] = field(default_factory=dict)
     last_update: Optional[datetime] = None
+    # ISO-строка last_update, чтобы не форматировать дату на каждый запрос
+    last_update_iso: Optional[str] = None
+    # ETag/Last-Modified ответа GitHub для текущей матрицы (условные запросы)
+    upstream_validators: Dict[str, str] = field(default_factory=dict)
     update_interval: int = UPDATE_INTERVALS["24_hours"]
-    is_updating: bool = False
     update_count: int = 0
+    # Защищает загрузку и разбор от параллельного запуска (ручного и фонового)
+    update_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # Фоновая задача периодического обновления, отменяется при завершении
+    update_task: Optional[asyncio.Task] = None
     # Индекс для быстрого поиска техник по ID
-    technique_index: Dict[str, Dict] = {}
+    technique_index: Dict[str, Dict] = field(default_factory=dict)
     # Индекс для быстрого поиска подтехник по ID
-    subtechnique_index: Dict[str, Dict] = {}
+    subtechnique_index: Dict[str, Dict] = field(default_factory=dict)
+    # Плоский индекс для /api/search: (тактика, техника, строка поиска в нижнем регистре)
+    search_index: List[Tuple[str, Dict, str]] = field(default_factory=list)
+    # Техники тактики, сгруппированные по платформе (в нижнем регистре)
+    matrix_by_tactic_platform: Dict[str, Dict[str, List[Dict]]] = field(default_factory=dict)
+    # Содержимое frontend/index.html, читается один раз при запуске
+    index_html: Optional[bytes] = None
+
+    @property
+    def is_updating(self) -> bool:
+        return self.update_lock.locked()
 
 
 # Создание директории кэша
@@ -72,64 +138,98 @@ class MatrixStats(BaseModel):
     update_count: int
 
 
-class ExternalReference(BaseModel):
+# Структуры матрицы: только для типизации, эндпоинты отдают обычные dict
+# без рекурсивной валидации Pydantic
+class ExternalReference(TypedDict, total=False):
     source_name: str
-    description: Optional[str] = None
-    url: Optional[str] = None
-    external_id: Optional[str] = None
+    description: Optional[str]
+    url: Optional[str]
+    external_id: Optional[str]
 
 
-class Technique(BaseModel):
+class Technique(TypedDict, total=False):
     id: str
     name: str
     description: str
-    platforms: List[str] = []
-    tactics: List[str] = []
-    mitre_url: Optional[str] = None
-    detection: Optional[str] = None
-    external_references: List[ExternalReference] = []
-    kill_chain_phases: List[str] = []
-    subtechniques: Optional[List["Technique"]] = None
+    platforms: List[str]
+    tactics: List[str]
+    mitre_url: Optional[str]
+    detection: Optional[str]
+    external_references: List[ExternalReference]
+    kill_chain_phases: List[str]
+    stix_id: str
+    subtechniques: List["Technique"]
 
 
-class TacticData(BaseModel):
+class TacticData(TypedDict):
     name: str
     shortname: str
     description: str
     techniques: List[Technique]
 
 
-async def download_matrix() -> Optional[Dict]:
-    """Загружает матрицу с GitHub, безопасно обрабатывая text/plain"""
+async def download_matrix(
+    session: aiohttp.ClientSession, validators: Dict[str, str]
+) -> Optional[Tuple[Optional[List[Dict]], Dict[str, str]]]:
+    """Загружает матрицу с GitHub потоково, возвращая только нужные STIX-объекты
 
-    try:
-        logger.info("📥 Загружаю матрицу MITRE с GitHub...")
+    Бандл не материализуется целиком: ijson разбирает массив objects по мере
+    поступления данных из сети, и в памяти остаются лишь тактики и техники.
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                GITHUB_URL, timeout=aiohttp.ClientTimeout(total=60)
-            ) as response:
-                if response.status != 200:
-                    logger.error(f"❌ Ошибка загрузки: статус {response.status}")
-                    return None
+    validators (etag, last_modified) прошлой загрузки отправляются как условный
+    запрос. Возвращает (объекты, новые validators), (None, validators), если
+    GitHub ответил 304 Not Modified, или None при ошибке.
+    """
 
-                text = await response.text()
-                try:
-                    data = json.loads(text)
-                except json.JSONDecodeError as e:
-                    logger.error(f"❌ Ошибка JSON-декодинга: {e}")
-                    return None
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
 
-                logger.info("✅ Матрица успешно загружена")
-                return data
+    try:
+        logger.info("📥 Загружаю матрицу MITRE с GitHub...")
+
+        async with session.get(GITHUB_URL, headers=headers) as response:
+            if response.status == 304:
+                logger.info("✅ Матрица на GitHub не изменилась")
+                return None, validators
+
+            if response.status != 200:
+                logger.error("❌ Ошибка загрузки: статус %s", response.status)
+                return None
+
+            objects: List[Dict] = []
+            try:
+                async for obj in ijson.items_async(
+                    response.content, "objects.item", use_float=True
+                ):
+                    if obj.get("type") in STIX_OBJECT_TYPES:
+                        trimmed = {k: obj[k] for k in STIX_OBJECT_FIELDS if k in obj}
+                        # Интернированный тип совпадает с константой по ссылке,
+                        # и сравнение в parse_matrix не доходит до сравнения символов
+                        trimmed["type"] = sys.intern(trimmed["type"])
+                        objects.append(trimmed)
+            except ijson.JSONError as e:
+                logger.error("❌ Ошибка JSON-декодинга: %s", e)
+                return None
+
+            new_validators = {}
+            if "ETag" in response.headers:
+                new_validators["etag"] = response.headers["ETag"]
+            if "Last-Modified" in response.headers:
+                new_validators["last_modified"] = response.headers["Last-Modified"]
+
+            logger.info("✅ Матрица успешно загружена")
+            return objects, new_validators
 
     except Exception as e:
-        logger.error(f"❌ Ошибка при загрузке: {e}")
+        logger.error("❌ Ошибка при загрузке: %s", e)
         return None
 
 
-def parse_matrix(raw_data: Dict) -> Optional[Dict]:
-    """Парсит матрицу из сырых данных с иерархией: Тактика -> Техника -> Подтехника
+def parse_matrix(objects: Iterable[Dict]) -> Optional[Dict]:
+    """Парсит матрицу из STIX-объектов с иерархией: Тактика -> Техника -> Подтехника
 
     Собираем расширенные данные:
     - ATT&CK ID (Txxxx/Txxxx.yy)
@@ -141,31 +241,32 @@ def parse_matrix(raw_data: Dict) -> Optional[Dict]:
 
     try:
         techniques: Dict[str, Dict] = {}
-        subtechniques: Dict[str, Dict] = {}
         tactics: Dict[str, Dict] = {}
-        matrix: Dict[str, List[Dict]] = {}
-        technique_index: Dict[str, Dict] = {}
-        subtechnique_index: Dict[str, Dict] = {}
+        # Техники раскладываются по тактикам сразу при разборе; тактики могут идти
+        # в бандле после техник, поэтому неизвестные отсеиваются в конце
+        techniques_by_tactic: Dict[str, List[Dict]] = defaultdict(list)
+        # Подтехники группируются по ATT&CK ID родителя (T1234.001 -> T1234)
+        subs_by_parent: Dict[str, List[Dict]] = defaultdict(list)
 
-        objects = raw_data.get("objects", [])
-
-        # Первый проход: собираем тактики и сырые техники с расширенными данными
+        # Единственный проход: собираем тактики и техники с расширенными данными
         for obj in objects:
             obj_type = obj.get("type", "")
 
-            if obj_type == "x-mitre-tactic":
+            if obj_type == STIX_TACTIC:
                 tactic_name = obj.get("name", "Unknown").lower().replace(" ", "-")
                 tactics[tactic_name] = {
                     "name": obj.get("name", "Unknown"),
                     "description": obj.get("description", ""),
                     "shortname": obj.get("x_mitre_shortname", ""),
                 }
-                matrix[tactic_name] = []
 
-            elif obj_type == "attack-pattern":
+            elif obj_type == STIX_ATTACK_PATTERN:
                 is_subtechnique = obj.get("x_mitre_is_subtechnique", False)
                 kill_chain = obj.get("kill_chain_phases", [])
-                tactic_names = [kc.get("phase_name", "").lower() for kc in kill_chain]
+                # Тактики, платформы и source_name повторяются в сотнях объектов —
+                # интернируем их, чтобы все техники ссылались на одни и те же строки
+                kc_phases = [sys.intern(kc.get("phase_name", "")) for kc in kill_chain]
+                tactic_names = [sys.intern(phase.lower()) for phase in kc_phases]
 
                 external_refs = obj.get("external_references", [])
 
@@ -191,7 +292,7 @@ def parse_matrix(raw_data: Dict) -> Optional[Dict]:
                 formatted_refs = []
                 for ref in external_refs:
                     formatted_refs.append({
-                        "source_name": ref.get("source_name", ""),
+                        "source_name": sys.intern(ref.get("source_name", "")),
                         "description": ref.get("description"),
                         "url": ref.get("url"),
                         "external_id": ref.get("external_id"),
@@ -201,13 +302,13 @@ def parse_matrix(raw_data: Dict) -> Optional[Dict]:
                     "id": external_id,
                     "name": obj.get("name", "Unknown"),
                     "description": obj.get("description", "") or "Описание недоступно в STIX JSON.",
-                    "platforms": obj.get("x_mitre_platforms", []),
+                    "platforms": [sys.intern(p) for p in obj.get("x_mitre_platforms", [])],
                     "tactics": tactic_names,
                     "mitre_url": mitre_url,
                     "detection": detection,
                     "external_references": formatted_refs,
-                    "kill_chain_phases": [kc.get("phase_name", "") for kc in kill_chain],
-                    "stix_id": obj.get("id", ""),  # Добавляем STIX ID для отладки
+                    "kill_chain_phases": kc_phases,
+                    "stix_id": obj.get("id", ""),
                 }
 
                 # Если external_id не начинается с T, толку от него мало для матрицы
@@ -215,70 +316,32 @@ def parse_matrix(raw_data: Dict) -> Optional[Dict]:
                     continue
 
                 if is_subtechnique:
-                    subtechniques[obj.get("id")] = tech_data
+                    subs_by_parent[external_id.split(".", 1)[0]].append(tech_data)
                 else:
                     techniques[obj.get("id")] = tech_data
-
-        # Индексируем техники и подтехники по ID для быстрого поиска
-        for tech_id, tech_data in techniques.items():
-            technique_index[tech_data["id"].upper()] = tech_data
-
-        for sub_id, sub_data in subtechniques.items():
-            subtechnique_index[sub_data["id"].upper()] = sub_data
-
-        # Второй проход: строим матрицу с подтехниками
-        for tech_obj_id, technique in techniques.items():
-            technique_subtechniques = []
-            for sub_obj_id, subtech in subtechniques.items():
-                # Сравниваем ATT&CK ID подпотехники и техники по префиксу (T1234.xx начинается с T1234)
-                if subtech["id"].startswith(technique["id"] + "."):
-                    technique_subtechniques.append(
-                        {
-                            "id": subtech["id"],
-                            "name": subtech["name"],
-                            "description": subtech["description"],
-                            "platforms": subtech["platforms"],
-                            "tactics": subtech["tactics"],
-                            "mitre_url": subtech["mitre_url"],
-                            "detection": subtech["detection"],
-                            "external_references": subtech["external_references"],
-                            "kill_chain_phases": subtech["kill_chain_phases"],
-                        }
-                    )
-
-            technique_obj = {
-                "id": technique["id"],
-                "name": technique["name"],
-                "description": technique["description"],
-                "platforms": technique["platforms"],
-                "tactics": technique["tactics"],
-                "mitre_url": technique["mitre_url"],
-                "detection": technique["detection"],
-                "external_references": technique["external_references"],
-                "kill_chain_phases": technique["kill_chain_phases"],
-                "subtechniques": sorted(
-                    technique_subtechniques, key=lambda x: x["id"]
-                ),
-            }
-
-            for tactic in technique["tactics"]:
-                if tactic in matrix:
-                    matrix[tactic].append(technique_obj)
-
-        # Сортируем техники внутри каждой тактики по ID
-        for tactic_key in matrix:
-            matrix[tactic_key].sort(key=lambda x: x["id"])
+                    for tactic in tactic_names:
+                        techniques_by_tactic[tactic].append(tech_data)
+
+        # Привязываем подтехники к техникам (записи общие, без копирования)
+        for bucket in subs_by_parent.values():
+            bucket.sort(key=lambda x: x["id"])
+        for technique in techniques.values():
+            technique["subtechniques"] = subs_by_parent.get(technique["id"], [])
+
+        # Матрица в порядке тактик, техники внутри тактики отсортированы по ID
+        matrix: Dict[str, List[Dict]] = {
+            tactic: sorted(techniques_by_tactic.get(tactic, []), key=lambda x: x["id"])
+            for tactic in tactics
+        }
 
         # Подсчёт статистики
         total_subtechniques = sum(
-            len(t["subtechniques"]) for t in sum(matrix.values(), [])
+            len(t["subtechniques"]) for t in chain.from_iterable(matrix.values())
         )
 
         return {
             "tactics": tactics,
             "matrix": matrix,
-            "technique_index": technique_index,  # Добавляем индекс в результат
-            "subtechnique_index": subtechnique_index,  # Добавляем индекс подтехник
             "statistics": {
                 "total_tactics": len(tactics),
                 "total_techniques": len(techniques),
@@ -287,47 +350,233 @@ def parse_matrix(raw_data: Dict) -> Optional[Dict]:
         }
 
     except Exception as e:
-        logger.error(f"❌ Ошибка при парсинге: {e}")
+        logger.error("❌ Ошибка при парсинге: %s", e)
         import traceback
         traceback.print_exc()
         return None
 
 
-def save_to_cache(data: Dict) -> None:
-    """Сохраняет данные в кэш"""
+def _save_to_cache_sync(data_gzip: bytes, update_interval: int, validators: Dict[str, str]) -> None:
+    """Сохраняет данные в кэш (блокирующая версия для пула потоков)"""
 
     try:
-        # Не сохраняем индексы в кэш, они будут пересчитаны при загрузке
-        cache_data = {k: v for k, v in data.items() if k not in ["technique_index", "subtechnique_index"]}
-
-        with open(CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(cache_data, f, ensure_ascii=False, indent=2)
+        # Компактный JSON, сжатый gzip, — те же байты, что отдаёт /api/matrix
+        CACHE_FILE.write_bytes(data_gzip)
 
         metadata = {
             "last_update": datetime.now().isoformat(),
-            "update_interval": app.state.state.update_interval,
+            "update_interval": update_interval,
+            **validators,
         }
-        with open(CACHE_METADATA, "w", encoding="utf-8") as f:
-            json.dump(metadata, f)
+        CACHE_METADATA.write_bytes(orjson.dumps(metadata))
+        LEGACY_CACHE_FILE.unlink(missing_ok=True)
 
         logger.info("✅ Данные сохранены в кэш")
     except Exception as e:
-        logger.error(f"❌ Ошибка при сохранении кэша: {e}")
+        logger.error("❌ Ошибка при сохранении кэша: %s", e)
+
+
+async def save_to_cache() -> None:
+    """Сохраняет текущую матрицу в кэш, не блокируя цикл событий"""
+
+    await asyncio.to_thread(
+        _save_to_cache_sync,
+        app.state.state.matrix_data_gzip,
+        app.state.state.update_interval,
+        app.state.state.upstream_validators,
+    )
+
+
+def share_technique_records(matrix: Dict[str, List[Dict]]) -> None:
+    """Заменяет копии техники в разных тактиках ссылками на одну запись
+
+    В JSON нет ссылок, поэтому техника из нескольких тактик после загрузки кэша
+    превращается в несколько одинаковых dict; parse_matrix же хранит одну запись.
+    """
+
+    canonical: Dict[str, Dict] = {}
+    for techniques in matrix.values():
+        for i, tech in enumerate(techniques):
+            techniques[i] = canonical.setdefault(tech["id"], tech)
 
 
-def load_from_cache() -> Optional[Dict]:
-    """Загружает данные из кэша"""
+def _load_from_cache_sync() -> Optional[Tuple["PreparedMatrix", Dict]]:
+    """Загружает и подготавливает матрицу и метаданные кэша (блокирующая версия для пула потоков)"""
 
     try:
         if CACHE_FILE.exists():
-            with open(CACHE_FILE, "r", encoding="utf-8") as f:
-                logger.info("📂 Загружаю данные из кэша")
-                return json.load(f)
+            logger.info("📂 Загружаю данные из кэша")
+            # Кэш хранит ровно те байты, что отдаёт /api/matrix: сжатые и
+            # распакованные байты используются как есть, без повторной сериализации
+            data_gzip = CACHE_FILE.read_bytes()
+            data_bytes = gzip.decompress(data_gzip)
+            data = orjson.loads(data_bytes)
+            share_technique_records(data.get("matrix", {}))
+            metadata = orjson.loads(CACHE_METADATA.read_bytes()) if CACHE_METADATA.exists() else {}
+            return prepare_matrix(data, data_bytes, data_gzip), metadata
     except Exception as e:
-        logger.error(f"❌ Ошибка при загрузке кэша: {e}")
+        logger.error("❌ Ошибка при загрузке кэша: %s", e)
     return None
 
 
+async def load_from_cache() -> Optional[Tuple["PreparedMatrix", Dict]]:
+    """Загружает подготовленную матрицу и метаданные кэша, не блокируя цикл событий"""
+
+    return await asyncio.to_thread(_load_from_cache_sync)
+
+
+def build_search_index(matrix: Dict[str, List[Dict]]) -> List[Tuple[str, Dict, str]]:
+    """Строит плоский индекс для поиска: техника, за ней её подтехники
+
+    Поля для поиска (название, ID, описание, платформы) приводятся к нижнему
+    регистру один раз и склеиваются через \\x00, чтобы совпадение не могло
+    захватить границу двух полей.
+    """
+
+    search_index: List[Tuple[str, Dict, str]] = []
+    for tactic, techniques in matrix.items():
+        for technique in techniques:
+            for item in [technique, *technique.get("subtechniques", [])]:
+                blob = "\x00".join(
+                    [
+                        item["name"].lower(),
+                        item["id"].lower(),
+                        (item.get("description") or "").lower(),
+                        *[p.lower() for p in item.get("platforms", [])],
+                    ]
+                )
+                search_index.append((tactic, item, blob))
+    return search_index
+
+
+def build_platform_index(matrix: Dict[str, List[Dict]]) -> Dict[str, Dict[str, List[Dict]]]:
+    """Группирует техники каждой тактики по платформам для фильтрации без перебора"""
+
+    by_tactic_platform: Dict[str, Dict[str, List[Dict]]] = {}
+    for tactic, techniques in matrix.items():
+        by_platform: Dict[str, List[Dict]] = defaultdict(list)
+        for technique in techniques:
+            for platform in dict.fromkeys(p.lower() for p in technique.get("platforms", [])):
+                by_platform[platform].append(technique)
+        by_tactic_platform[tactic] = dict(by_platform)
+    return by_tactic_platform
+
+
+def build_technique_index(matrix: Dict[str, List[Dict]]) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+    """Индексирует техники и подтехники по ATT&CK ID в верхнем регистре"""
+
+    technique_index: Dict[str, Dict] = {}
+    subtechnique_index: Dict[str, Dict] = {}
+    for techniques in matrix.values():
+        for tech in techniques:
+            technique_index[tech["id"].upper()] = tech
+            for sub in tech.get("subtechniques", []):
+                subtechnique_index[sub["id"].upper()] = sub
+    return technique_index, subtechnique_index
+
+
+@dataclass(slots=True)
+class PreparedMatrix:
+    """Матрица вместе с готовыми телами ответов и индексами"""
+
+    data: Dict
+    data_bytes: bytes
+    data_etag: str
+    data_gzip: bytes
+    data_gzip_etag: str
+    tactics_bytes: bytes
+    technique_index: Dict[str, Dict]
+    subtechnique_index: Dict[str, Dict]
+    search_index: List[Tuple[str, Dict, str]]
+    matrix_by_tactic_platform: Dict[str, Dict[str, List[Dict]]]
+
+
+def prepare_matrix(
+    data: Dict,
+    data_bytes: Optional[bytes] = None,
+    data_gzip: Optional[bytes] = None,
+) -> PreparedMatrix:
+    """Сериализует, сжимает и индексирует матрицу (блокирующая версия для пула потоков)
+
+    gzip и построение индексов занимают сотни миллисекунд на полной матрице,
+    поэтому всё это делается вне цикла событий, а apply_matrix_data только
+    присваивает готовые поля. Уже готовые байты (например, прочитанные из кэша)
+    передаются в data_bytes/data_gzip и повторно не вычисляются.
+    """
+
+    if data_bytes is None:
+        data_bytes = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    if data_gzip is None:
+        data_gzip = gzip.compress(data_bytes, compresslevel=5)
+    digest = hashlib.blake2b(data_bytes, digest_size=8).hexdigest()
+    matrix = data.get("matrix", {})
+    technique_index, subtechnique_index = build_technique_index(matrix)
+
+    return PreparedMatrix(
+        data=data,
+        data_bytes=data_bytes,
+        data_etag=f'"{digest}"',
+        data_gzip=data_gzip,
+        data_gzip_etag=f'"{digest}-gz"',
+        tactics_bytes=orjson.dumps(data.get("tactics", {})),
+        technique_index=technique_index,
+        subtechnique_index=subtechnique_index,
+        search_index=build_search_index(matrix),
+        matrix_by_tactic_platform=build_platform_index(matrix),
+    )
+
+
+def apply_matrix_data(prepared: PreparedMatrix) -> None:
+    """Устанавливает подготовленную матрицу и отмечает время обновления"""
+
+    state = app.state.state
+    state.matrix_data = prepared.data
+    state.last_update = datetime.now()
+    state.last_update_iso = state.last_update.isoformat()
+    state.matrix_data_bytes = prepared.data_bytes
+    state.matrix_data_etag = prepared.data_etag
+    state.matrix_data_gzip = prepared.data_gzip
+    state.matrix_data_gzip_etag = prepared.data_gzip_etag
+
+    state.tactics_bytes = prepared.tactics_bytes
+    state.tactic_bytes = {}
+
+    state.technique_index = prepared.technique_index
+    state.subtechnique_index = prepared.subtechnique_index
+    state.search_index = prepared.search_index
+    state.matrix_by_tactic_platform = prepared.matrix_by_tactic_platform
+
+
+async def reload_matrix() -> Optional[bool]:
+    """Загружает, разбирает и применяет свежую матрицу с GitHub
+
+    Возвращает True, если матрица обновлена, False, если она не изменилась
+    (304 Not Modified), и None при ошибке загрузки или разбора.
+    """
+
+    state = app.state.state
+    result = await download_matrix(state.http, state.upstream_validators)
+    if result is None:
+        return None
+
+    stix_objects, validators = result
+    if stix_objects is None:
+        return False
+    if not stix_objects:
+        return None
+
+    # Разбор, сериализация, сжатие и индексы — чистая CPU-работа,
+    # выполняем её вне цикла событий
+    parsed_data = await asyncio.to_thread(parse_matrix, stix_objects)
+    if not parsed_data:
+        return None
+
+    apply_matrix_data(await asyncio.to_thread(prepare_matrix, parsed_data))
+    state.upstream_validators = validators
+    await save_to_cache()
+    return True
+
+
 async def update_matrix_task() -> None:
     """Фоновая задача обновления матрицы"""
 
@@ -335,29 +584,21 @@ async def update_matrix_task() -> None:
         try:
             await asyncio.sleep(app.state.state.update_interval)
 
-            if not app.state.state.is_updating:
-                app.state.state.is_updating = True
+            # Если уже идёт ручное обновление, пропускаем этот цикл
+            if app.state.state.update_lock.locked():
+                continue
+
+            async with app.state.state.update_lock:
                 logger.info("🔄 Начинаю обновление матрицы...")
 
-                raw_data = await download_matrix()
-                if raw_data:
-                    parsed_data = parse_matrix(raw_data)
-                    if parsed_data:
-                        app.state.state.matrix_data = parsed_data
-                        app.state.state.technique_index = parsed_data.get("technique_index", {})
-                        app.state.state.subtechnique_index = parsed_data.get("subtechnique_index", {})
-                        app.state.state.last_update = datetime.now()
-                        app.state.state.update_count += 1
-                        save_to_cache(parsed_data)
-                        logger.info(
-                            "✅ Обновление #%s завершено",
-                            app.state.state.update_count,
-                        )
-
-                app.state.state.is_updating = False
+                if await reload_matrix():
+                    app.state.state.update_count += 1
+                    logger.info(
+                        "✅ Обновление #%s завершено",
+                        app.state.state.update_count,
+                    )
         except Exception as e:
-            logger.error(f"❌ Ошибка в фоновой задаче: {e}")
-            app.state.state.is_updating = False
+            logger.error("❌ Ошибка в фоновой задаче: %s", e)
 
 
 @asynccontextmanager
@@ -367,39 +608,43 @@ async def lifespan(app: FastAPI):
     app.state.state = AppState()
     logger.info("🚀 Запуск приложения...")
 
-    cached_data = load_from_cache()
-    if cached_data:
-        # Пересчитываем индексы при загрузке из кэша
-        app.state.state.matrix_data = cached_data
-        app.state.state.last_update = datetime.now()
-        
-        # Пересчитываем индексы
-        app.state.state.technique_index = {}
-        app.state.state.subtechnique_index = {}
-        
-        for tactics_dict in cached_data.get("matrix", {}).values():
-            for tech in tactics_dict:
-                app.state.state.technique_index[tech["id"].upper()] = tech
-                for sub in tech.get("subtechniques", []):
-                    app.state.state.subtechnique_index[sub["id"].upper()] = sub
-        
-        logger.info(f"✅ Матрица загружена из кэша. Индекс содержит {len(app.state.state.technique_index)} техник и {len(app.state.state.subtechnique_index)} подтехник")
+    try:
+        app.state.state.index_html = FRONTEND_INDEX.read_bytes()
+    except FileNotFoundError:
+        logger.warning("⚠️  Frontend не найден: %s", FRONTEND_INDEX)
+
+    app.state.state.http = aiohttp.ClientSession(
+        headers={"User-Agent": f"matrix-mitre/{app.version}"},
+        timeout=aiohttp.ClientTimeout(total=60),
+        connector=aiohttp.TCPConnector(limit=4, ttl_dns_cache=300),
+    )
+
+    cached = await load_from_cache()
+    if cached:
+        prepared, metadata = cached
+        # Индексы не хранятся в кэше и пересчитываются в prepare_matrix
+        apply_matrix_data(prepared)
+        app.state.state.upstream_validators = {
+            k: metadata[k] for k in ("etag", "last_modified") if k in metadata
+        }
+
+        logger.info(
+            "✅ Матрица загружена из кэша. Индекс содержит %s техник и %s подтехник",
+            len(app.state.state.technique_index),
+            len(app.state.state.subtechnique_index),
+        )
     else:
-        raw_data = await download_matrix()
-        if raw_data:
-            parsed_data = parse_matrix(raw_data)
-            if parsed_data:
-                app.state.state.matrix_data = parsed_data
-                app.state.state.technique_index = parsed_data.get("technique_index", {})
-                app.state.state.subtechnique_index = parsed_data.get("subtechnique_index", {})
-                app.state.state.last_update = datetime.now()
-                save_to_cache(parsed_data)
-
-    asyncio.create_task(update_matrix_task())
+        await reload_matrix()
+
+    app.state.state.update_task = asyncio.create_task(update_matrix_task())
 
     yield
 
     logger.info("🛑 Завершение работы приложения...")
+    app.state.state.update_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await app.state.state.update_task
+    await app.state.state.http.close()
 
 
 app = FastAPI(
@@ -409,6 +654,9 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# MITRE JSON хорошо сжимается (повторяющиеся source_name, url, платформы)
+app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=5)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -420,39 +668,76 @@ app.add_middleware(
 
 @app.get("/", response_model=None)
 async def root():
-    html_path = Path("frontend/index.html")
-    if html_path.exists():
-        return HTMLResponse(content=html_path.read_text(encoding="utf-8"))
+    if app.state.state.index_html is not None:
+        return HTMLResponse(content=app.state.state.index_html)
     return {"message": "Frontend не найден"}
 
 
-@app.get("/api/matrix", tags=["Matrix"])
-async def get_matrix() -> Dict:
+def etag_matches(if_none_match: str, etags: Iterable[str]) -> bool:
+    """Проверяет If-None-Match: список через запятую, слабые W/ сравниваются как сильные"""
+
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return not candidates.isdisjoint(etags)
+
+
+@app.get("/api/matrix", tags=["Matrix"], response_model=Dict)
+async def get_matrix(request: Request) -> Response:
     if not app.state.state.matrix_data:
         raise HTTPException(status_code=503, detail="Матрица еще не загружена")
-    return app.state.state.matrix_data
+
+    # Уже сжатое тело GZipMiddleware пропускает без повторного сжатия
+    use_gzip = "gzip" in request.headers.get("accept-encoding", "")
+    etag = app.state.state.matrix_data_gzip_etag if use_gzip else app.state.state.matrix_data_etag
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+
+    # Клиент мог сохранить ответ в любой из кодировок — представление то же
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(
+        if_none_match, (app.state.state.matrix_data_etag, app.state.state.matrix_data_gzip_etag)
+    ):
+        return Response(status_code=304, headers=headers)
+
+    if use_gzip:
+        return Response(
+            content=app.state.state.matrix_data_gzip,
+            media_type="application/json",
+            headers={**headers, "Content-Encoding": "gzip"},
+        )
+
+    return Response(
+        content=app.state.state.matrix_data_bytes,
+        media_type="application/json",
+        headers=headers,
+    )
 
 
-@app.get("/api/matrix/tactics", tags=["Matrix"])
-async def get_tactics() -> Dict:
+@app.get("/api/matrix/tactics", tags=["Matrix"], response_model=Dict)
+async def get_tactics() -> Response:
     if not app.state.state.matrix_data:
         raise HTTPException(status_code=503, detail="Матрица еще не загружена")
-    return app.state.state.matrix_data.get("tactics", {})
+    return Response(content=app.state.state.tactics_bytes, media_type="application/json")
 
 
-@app.get("/api/matrix/tactic/{tactic}", tags=["Matrix"])
-async def get_tactic(tactic: str) -> Dict:
+@app.get("/api/matrix/tactic/{tactic}", tags=["Matrix"], response_model=Dict)
+async def get_tactic(tactic: str) -> Response:
     if not app.state.state.matrix_data:
         raise HTTPException(status_code=503, detail="Матрица еще не загружена")
 
     tactic_lower = tactic.lower().replace(" ", "-")
     matrix = app.state.state.matrix_data.get("matrix", {})
-    tactics = app.state.state.matrix_data.get("tactics", {})
 
     if tactic_lower not in matrix:
         raise HTTPException(status_code=404, detail=f"Тактика '{tactic}' не найдена")
 
-    return {"tactic": tactics.get(tactic_lower, {}), "techniques": matrix[tactic_lower]}
+    body = app.state.state.tactic_bytes.get(tactic_lower)
+    if body is None:
+        tactics = app.state.state.matrix_data.get("tactics", {})
+        body = orjson.dumps({"tactic": tactics.get(tactic_lower, {}), "techniques": matrix[tactic_lower]})
+        app.state.state.tactic_bytes[tactic_lower] = body
+
+    return Response(content=body, media_type="application/json")
 
 
 @app.get("/api/matrix/technique/{technique_id}", tags=["Matrix"])
@@ -469,27 +754,21 @@ async def get_technique(technique_id: str) -> Dict:
 
     # Сначала ищем в индексе подтехник (они более специфичны)
     if search_id in app.state.state.subtechnique_index:
-        logger.info(f"✅ Найдена подтехника {search_id} в индексе")
+        logger.info("✅ Найдена подтехника %s в индексе", search_id)
         return app.state.state.subtechnique_index[search_id]
 
     # Затем ищем в индексе техник
     if search_id in app.state.state.technique_index:
-        logger.info(f"✅ Найдена техника {search_id} в индексе")
+        logger.info("✅ Найдена техника %s в индексе", search_id)
         return app.state.state.technique_index[search_id]
 
-    # Фолбэк: полный поиск (на случай если индекс не обновился)
-    logger.warning(f"⚠️  {search_id} не найдена в индексах, выполняю полный поиск...")
-    matrix = app.state.state.matrix_data.get("matrix", {})
-    for _, techniques in matrix.items():
-        for tech in techniques:
-            if tech["id"].upper() == search_id:
-                return tech
-            for sub in tech.get("subtechniques", []):
-                if sub["id"].upper() == search_id:
-                    return sub
-
-    # Не нашли
-    logger.error(f"❌ Техника '{technique_id}' не найдена. Индекс содержит {len(app.state.state.technique_index)} техник и {len(app.state.state.subtechnique_index)} подтехник")
+    # Индексы пересобираются вместе с матрицей, так что промах означает отсутствие техники
+    logger.warning(
+        "❌ Техника '%s' не найдена. Индекс содержит %s техник и %s подтехник",
+        technique_id,
+        len(app.state.state.technique_index),
+        len(app.state.state.subtechnique_index),
+    )
     raise HTTPException(status_code=404, detail=f"Техника '{technique_id}' не найдена")
 
 
@@ -500,24 +779,13 @@ async def get_statistics() -> MatrixStats:
 
     stats = app.state.state.matrix_data.get("statistics", {})
 
-    interval_str = next(
-        (
-            k
-            for k, v in UPDATE_INTERVALS.items()
-            if v == app.state.state.update_interval
-        ),
-        "24_hours",
-    )
+    interval_str = SECONDS_TO_LABEL.get(app.state.state.update_interval, "24_hours")
 
     return MatrixStats(
         total_tactics=stats.get("total_tactics", 0),
         total_techniques=stats.get("total_techniques", 0),
         total_subtechniques=stats.get("total_subtechniques", 0),
-        last_update=(
-            app.state.state.last_update.isoformat()
-            if app.state.state.last_update
-            else None
-        ),
+        last_update=app.state.state.last_update_iso,
         update_interval=interval_str,
         is_updating=app.state.state.is_updating,
         update_count=app.state.state.update_count,
@@ -544,30 +812,31 @@ async def set_update_interval(request: UpdateIntervalRequest) -> Dict:
 
 @app.post("/api/matrix/refresh", tags=["Matrix"])
 async def refresh_matrix() -> Dict:
-    if app.state.state.is_updating:
+    # Между проверкой и захватом блокировки нет await, поэтому гонки нет
+    if app.state.state.update_lock.locked():
         raise HTTPException(status_code=429, detail="Обновление уже в процессе")
 
-    app.state.state.is_updating = True
-    try:
+    async with app.state.state.update_lock:
         logger.info("🔄 Принудительное обновление матрицы...")
-        raw_data = await download_matrix()
-        if raw_data:
-            parsed_data = parse_matrix(raw_data)
-            if parsed_data:
-                app.state.state.matrix_data = parsed_data
-                app.state.state.technique_index = parsed_data.get("technique_index", {})
-                app.state.state.subtechnique_index = parsed_data.get("subtechnique_index", {})
-                app.state.state.last_update = datetime.now()
-                app.state.state.update_count += 1
-                save_to_cache(parsed_data)
-                return {
-                    "message": "Матрица успешно обновлена",
-                    "update_count": app.state.state.update_count,
-                    "last_update": app.state.state.last_update.isoformat(),
-                }
-        raise HTTPException(status_code=500, detail="Ошибка при загрузке матрицы")
-    finally:
-        app.state.state.is_updating = False
+        updated = await reload_matrix()
+        if updated is None:
+            raise HTTPException(status_code=500, detail="Ошибка при загрузке матрицы")
+
+        if updated:
+            app.state.state.update_count += 1
+        return {
+            "message": "Матрица успешно обновлена" if updated else "Матрица не изменилась",
+            "update_count": app.state.state.update_count,
+            "last_update": app.state.state.last_update_iso,
+        }
+
+
+def iter_search_matches(query: str) -> Iterator[Dict]:
+    """Лениво выдаёт совпадения из поискового индекса в порядке матрицы"""
+
+    for tactic, technique, blob in app.state.state.search_index:
+        if query in blob:
+            yield {"tactic": tactic, "technique": technique}
 
 
 @app.get("/api/search", tags=["Search"])
@@ -580,41 +849,9 @@ async def search_techniques(q: str = Query(..., min_length=1), limit: int = Quer
     if not app.state.state.matrix_data:
         raise HTTPException(status_code=503, detail="Матрица еще не загружена")
 
-    query = q.lower()
-    results = []
-
-    for tactic, techniques in app.state.state.matrix_data.get("matrix", {}).items():
-        for technique in techniques:
-            # Ищем в разных полях
-            match = (
-                query in technique["name"].lower()
-                or query in technique["id"].lower()
-                or query in technique.get("description", "").lower()
-                or any(query in platform.lower() for platform in technique.get("platforms", []))
-            )
-
-            if match:
-                results.append({"tactic": tactic, "technique": technique})
-
-            # Ищем также в подтехниках
-            if len(results) < limit:
-                for sub in technique.get("subtechniques", []):
-                    sub_match = (
-                        query in sub["name"].lower()
-                        or query in sub["id"].lower()
-                        or query in sub.get("description", "").lower()
-                        or any(query in platform.lower() for platform in sub.get("platforms", []))
-                    )
-                    if sub_match:
-                        results.append({"tactic": tactic, "technique": sub})
-
-            if len(results) >= limit:
-                break
+    results = list(islice(iter_search_matches(q.lower()), limit))
 
-        if len(results) >= limit:
-            break
-
-    return {"query": q, "count": len(results), "results": results[:limit]}
+    return {"query": q, "count": len(results), "results": results}
 
 
 @app.get("/api/matrix/tactics/{tactic}/techniques", tags=["Matrix"])
@@ -635,11 +872,12 @@ async def get_tactic_techniques(
     if tactic_lower not in matrix:
         raise HTTPException(status_code=404, detail=f"Тактика '{tactic}' не найдена")
 
-    techniques = matrix[tactic_lower]
-
-    # Фильтруем по платформе если указана
+    # Фильтр по платформе берём из заранее построенного индекса
     if platform:
-        techniques = [t for t in techniques if platform.lower() in [p.lower() for p in t.get("platforms", [])]]
+        by_platform = app.state.state.matrix_by_tactic_platform.get(tactic_lower, {})
+        techniques = by_platform.get(platform.lower(), [])
+    else:
+        techniques = matrix[tactic_lower]
 
     if limit:
         techniques = techniques[:limit]
@@ -650,7 +888,7 @@ async def get_tactic_techniques(
 try:
     app.mount("/static", StaticFiles(directory="frontend"), name="static")
 except Exception as e:
-    logger.warning(f"⚠️  Не удалось смонтировать статические файлы: {e}")
+    logger.warning("⚠️  Не удалось смонтировать статические файлы: %s", e)
 
 
 if __name__ == "__main__":